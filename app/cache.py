@@ -0,0 +1,127 @@
+# app/cache.py
+from cachetools import TTLCache
+from typing import NamedTuple, Optional
+import redis.asyncio as redis
+import hashlib
+import logging
+import orjson
+import os
+import time
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_ITEM_TTL = int(os.getenv("REDIS_ITEM_TTL", 300))
+# Keep these tight: a hung Redis must fall back to the database quickly, not stall requests
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.05))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 0.1))
+# After a Redis error, skip Redis for this many seconds so an outage doesn't add a timeout to every miss
+REDIS_COOLDOWN = float(os.getenv("REDIS_COOLDOWN", 5))
+
+log = logging.getLogger(__name__)
+
+
+class CachedItem(NamedTuple):
+    etag: str
+    payload: dict
+    body: bytes  # Pre-serialized JSON, written to the socket as-is
+
+
+# Hot items kept in-process. Invalidations only reach this replica's copy, so other replicas
+# may serve a changed item for up to ITEM_CACHE_TTL seconds before re-reading Redis or the database.
+# Every access happens on the event loop without awaiting in between, so no lock is needed.
+item_cache = TTLCache(
+    maxsize=int(os.getenv("ITEM_CACHE_MAXSIZE", 10_000)),
+    ttl=int(os.getenv("ITEM_CACHE_TTL", 60)),
+)
+
+# Shared across replicas; created in connect() on startup
+redis_client: Optional[redis.Redis] = None
+# time.monotonic() before which Redis is treated as unavailable
+_redis_retry_at = 0.0
+
+
+async def connect():
+    global redis_client
+    redis_client = redis.from_url(
+        REDIS_URL,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    )
+
+
+async def close():
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+
+
+def make_etag(body: bytes) -> str:
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _redis_key(item_id: int) -> str:
+    return f"item:{item_id}"
+
+
+def _redis() -> Optional[redis.Redis]:
+    if redis_client is None or time.monotonic() < _redis_retry_at:
+        return None
+    return redis_client
+
+
+def _redis_failed(action: str, item_id: int, e: Exception):
+    # A cache outage should degrade to database reads, not fail the request; warn once per cool-down
+    global _redis_retry_at
+    _redis_retry_at = time.monotonic() + REDIS_COOLDOWN
+    log.warning("Redis %s failed for item %s, bypassing Redis for %ss: %s", action, item_id, REDIS_COOLDOWN, e)
+
+
+def _build(payload: dict, body: bytes) -> CachedItem:
+    return CachedItem(etag=make_etag(body), payload=payload, body=body)
+
+
+async def get_item(item_id: int) -> Optional[CachedItem]:
+    cached = item_cache.get(item_id)
+    client = _redis()
+    if cached is not None or client is None:
+        return cached
+    try:
+        body = await client.get(_redis_key(item_id))
+    except redis.RedisError as e:
+        _redis_failed("read", item_id, e)
+        return None
+    if body is None:
+        return None
+    cached = _build(orjson.loads(body), body)
+    item_cache[item_id] = cached
+    return cached
+
+
+async def set_item(item_id: int, payload: dict) -> CachedItem:
+    cached = _build(payload, orjson.dumps(payload))
+    item_cache[item_id] = cached
+    client = _redis()
+    if client is not None:
+        try:
+            await client.set(_redis_key(item_id), cached.body, ex=REDIS_ITEM_TTL)
+        except redis.RedisError as e:
+            _redis_failed("write", item_id, e)
+    return cached
+
+
+async def invalidate_item(item_id: int):
+    item_cache.pop(item_id, None)
+    client = _redis()
+    if client is not None:
+        try:
+            await client.delete(_redis_key(item_id))
+        except redis.RedisError as e:
+            _redis_failed("invalidation", item_id, e)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
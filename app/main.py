@@ -1,88 +1,148 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from . import models, schemas, database, observability
-import time
-from sqlalchemy.exc import OperationalError
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, database, observability, cache
+import asyncio
+import random
+from sqlalchemy.exc import DBAPIError
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 import logging
+import os
+
+log = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Rows per multi-row INSERT in the bulk endpoint; Postgres gains little past ~1k
+BULK_INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", 1000))
+
 # Setup observability
-observability.setup_observability(app)
+log_listener = observability.setup_observability(app)
 
 # Dependency
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @app.on_event("startup")
 async def startup_event():
-    max_retries = 5
-    retry_delay = 5
+    await cache.connect()
+    max_retries = 8
     for i in range(max_retries):
         try:
-            database.create_tables()
-            print("Database tables created successfully")
+            await database.create_tables()
+            await database.warm_pool()
+            log.info("Database tables created successfully")
             break
-        except OperationalError:
+        except (DBAPIError, OSError):
             if i < max_retries - 1:
-                print(f"Database not ready, retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                # Exponential backoff with jitter so replicas don't retry in lockstep
+                retry_delay = min(30, 0.5 * (2 ** i) + random.random())
+                log.warning("Database not ready, retrying in %.1f seconds...", retry_delay)
+                await asyncio.sleep(retry_delay)
             else:
-                print("Max retries reached. Could not connect to the database.")
+                log.error("Max retries reached. Could not connect to the database.")
                 raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cache.close()
+    observability.mark_metrics_process_dead()
+    log_listener.stop()  # Drain queued log records before exiting
+
 # Custom handler for 422 errors
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    logging.error(f"Validation error for request {request.url}: {exc.errors()}")
+    log.error("Validation error for request %s: %s", request.url, exc.errors())
     return JSONResponse(
         status_code=422,
-        content={"detail": exc.errors()},
+        content={"detail": jsonable_encoder(exc.errors())},  # Pydantic v2 errors may carry exception objects
     )
 
 @app.post("/items/", response_model=schemas.Item)
-def create_item(item: schemas.ItemCreate, db: Session = Depends(get_db)):
+async def create_item(item: schemas.ItemCreate, db: AsyncSession = Depends(get_db)):
+    data = item.model_dump()
     try:
-        logging.info("Attempting to create a new item", extra={"item_data": item.dict()})
-        db_item = models.Item(**item.dict())
-        db.add(db_item)
-        db.commit()
-        db.refresh(db_item)
-        logging.info(f"Successfully created new item: {db_item.id}", extra={"item_name": db_item.name})
-        return db_item
+        if log.isEnabledFor(logging.INFO):
+            log.info("Attempting to create a new item", extra={"item_data": data})
+        # RETURNING hands back the generated id, so no follow-up SELECT is needed
+        stmt = insert(models.Item).values(**data).returning(models.Item.id)
+        new_id = (await db.execute(stmt)).scalar_one()
+        await db.commit()
+        # A new id can't be cached yet (misses aren't cached); this is the hook future
+        # update/delete paths need. It clears Redis and this replica's in-process cache only.
+        await cache.invalidate_item(new_id)
+        if log.isEnabledFor(logging.INFO):
+            log.info("Successfully created new item: %s", new_id, extra={"item_name": data["name"]})
+        return schemas.Item(id=new_id, **data)
     except HTTPException as http_exc:
-        logging.error(f"HTTP error while creating item: {str(http_exc)}")
+        log.error("HTTP error while creating item: %s", http_exc)
         raise http_exc
     except Exception as e:
-        logging.error(f"Failed to create item: {str(e)}", extra={"item_data": item.dict()})
-        db.rollback()  # Rollback the transaction in case of an error
+        log.error("Failed to create item: %s", e, extra={"item_data": data})
+        await db.rollback()  # Rollback the transaction in case of an error
         raise HTTPException(status_code=500, detail="Failed to create item")
 
-@app.get("/items/{item_id}", response_model=schemas.Item)
-def read_item(item_id: int, db: Session = Depends(get_db)):
+@app.post("/items/bulk")
+async def create_items_bulk(payload: schemas.ItemBulkCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        log.info("Attempting to bulk create %s items", len(payload))
+        rows = [item.model_dump() for item in payload]
+        stmt = insert(models.Item)
+        for start in range(0, len(rows), BULK_INSERT_BATCH_SIZE):
+            await db.execute(stmt, rows[start:start + BULK_INSERT_BATCH_SIZE])
+        await db.commit()  # Single transaction for the whole payload
+        log.info("Successfully bulk created %s items", len(rows))
+        return {"inserted": len(rows)}
+    except Exception as e:
+        log.error("Failed to bulk create items: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Failed to create items")
+
+# No response_model: cached bytes are returned directly instead of re-validating through Pydantic
+@app.get("/items/{item_id}", responses={200: {"model": schemas.Item}})
+async def read_item(item_id: int, request: Request, db: AsyncSession = Depends(get_db)):
     try:
-        logging.info(f"Attempting to retrieve item: {item_id}")
-        item = db.query(models.Item).filter(models.Item.id == item_id).first()
-        if item is None:
-            logging.warning(f"Item not found: {item_id}")
-            raise HTTPException(status_code=404, detail="Item not found")
-        logging.info(f"Successfully retrieved item: {item_id}", extra={"item_name": item.name})
-        return item
+        log.info("Attempting to retrieve item: %s", item_id)
+        cached = await cache.get_item(item_id)
+        if cached is None:
+            item = await db.get(models.Item, item_id)
+            if item is None:
+                log.warning("Item not found: %s", item_id)
+                raise HTTPException(status_code=404, detail="Item not found")
+            cached = await cache.set_item(item_id, schemas.Item.model_validate(item).model_dump())
+        if cache.etag_matches(request.headers.get("if-none-match"), cached.etag):
+            log.info("Item not modified: %s", item_id)
+            return Response(status_code=304, headers={"ETag": cached.etag})
+        if log.isEnabledFor(logging.INFO):
+            log.info("Successfully retrieved item: %s", item_id, extra={"item_name": cached.payload["name"]})
+        return Response(content=cached.body, media_type="application/json", headers={"ETag": cached.etag})
     except HTTPException as http_exc:
-        logging.error(f"HTTP error while retrieving item: {item_id}, error: {str(http_exc)}")
+        log.error("HTTP error while retrieving item: %s, error: %s", item_id, http_exc)
         raise http_exc
     except Exception as e:
-        logging.error(f"Unexpected error while retrieving item: {item_id}, error: {str(e)}")
+        log.error("Unexpected error while retrieving item: %s, error: %s", item_id, e)
         raise HTTPException(status_code=500, detail="Failed to retrieve item")
 
 # Add more endpoints as needed
 
 if __name__ == "__main__":
+    import tempfile
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker is a separate process with its own DB pool and metrics, so several workers
+    # aggregate metrics through PROMETHEUS_MULTIPROC_DIR. The container uses docker/start.sh instead.
+    workers = database.WORKERS
+    if workers > 1:
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+    uvicorn.run(
+        # The import string is required for workers > 1; a single worker serves this app object
+        # rather than importing the module a second time as app.main
+        "app.main:app" if workers > 1 else app,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 8000)),
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
\ No newline at end of file
@@ -1,27 +1,103 @@
 # Importing necessary modules from OpenTelemetry, Prometheus, FastAPI, and logging libraries
 
 from opentelemetry import trace  # Main entry point for tracing
-from opentelemetry.exporter.jaeger.thrift import JaegerExporter  # Exporter for sending spans to Jaeger
+from opentelemetry.propagate import extract  # Reads incoming trace context from request headers
+from opentelemetry.trace import SpanKind, Status, StatusCode  # Span metadata for server requests
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter  # Exporter for sending spans over OTLP/gRPC
+from grpc import Compression  # gRPC compression algorithms for the OTLP exporter
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource  # Defines resources, such as service name
 from opentelemetry.sdk.trace import TracerProvider  # Provides tracing capabilities
 from opentelemetry.sdk.trace.export import BatchSpanProcessor  # Processes spans in batches for efficiency
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor  # Auto-instruments FastAPI for tracing
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased  # Head-based trace sampling
 from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor  # Auto-instruments SQLAlchemy
-from prometheus_fastapi_instrumentator import Instrumentator  # Auto-instruments FastAPI for Prometheus metrics
-from prometheus_client import make_asgi_app, Counter, Histogram, Gauge  # Prometheus client for custom metrics
+from opentelemetry.util.http import ExcludeList, parse_excluded_urls  # OTel's regex list of untraced URLs
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, Gauge  # Prometheus client for custom metrics
+from prometheus_client import multiprocess  # Aggregates metrics across uvicorn worker processes
 import logging  # Standard logging library
-from pythonjsonlogger import jsonlogger  # Formatter for structured JSON logs
-from fastapi import Request, FastAPI  # FastAPI framework
-from .database import engine  # Database engine for SQLAlchemy
+from logging.handlers import QueueHandler, QueueListener  # Hand log records off to a background thread
+import queue  # Bounded queue between the request path and the log writer thread
+from contextlib import nullcontext  # Stand-in for the span context manager on untraced URLs
+from datetime import datetime, timezone  # Timestamps for structured JSON logs
+import orjson  # Fast JSON encoder for log records
+from fastapi import FastAPI, Response  # FastAPI framework
+from starlette.datastructures import URL  # Rebuilds the full request URL from the ASGI scope
+from .database import engine, WORKERS  # Database engine for SQLAlchemy and the uvicorn worker count
 import time  # For timing request durations
 import os  # For environment variable access
 
 # Define custom Prometheus metrics
 # Counters, Gauges, and Histograms track different aspects of request handling
+# http_requests_total and http_request_duration_seconds keep the names, labels, "2xx"-style status
+# grouping and buckets of prometheus-fastapi-instrumentator's defaults, so dashboards keep working.
+# Its request/response size and http_request_duration_highr_seconds series are no longer emitted.
 
-REQUEST_COUNT = Counter("http_requests_total", "Total number of HTTP requests")
-REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Duration of HTTP requests in seconds")
-IN_PROGRESS = Gauge("in_progress_requests", "Number of HTTP requests in progress")
+REQUEST_COUNT = Counter("http_requests_total", "Total number of HTTP requests", ["method", "handler", "status"])
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests in seconds",
+    ["method", "handler"],
+    buckets=(0.1, 0.5, 1),
+)
+IN_PROGRESS = Gauge("in_progress_requests", "Number of HTTP requests in progress", multiprocess_mode="livesum")
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord carries; anything else on a record came from extra={...}
+_RESERVED_LOG_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class OrjsonFormatter(logging.Formatter):
+    """
+    Formats log records as JSON using orjson instead of the stdlib json encoder.
+    Emits the same fields python-json-logger produced (asctime, levelname, name, message,
+    exc_info/stack_info when present, timestamp and any extra={...} keys) so downstream
+    Loki parsing is unaffected.
+    """
+
+    def format(self, record):
+        log_record = {
+            "asctime": self.formatTime(record),
+            "levelname": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_LOG_ATTRS:
+                log_record[key] = value
+        if record.exc_info:
+            log_record["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_record["exc_info"] = record.exc_text
+        if record.stack_info:
+            log_record["stack_info"] = self.formatStack(record.stack_info)
+        log_record["timestamp"] = datetime.fromtimestamp(record.created, tz=timezone.utc)
+        return orjson.dumps(log_record, default=str).decode()
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queue handler that enqueues records untouched, dropping (and counting) them when the queue is full.
+    The default prepare() formats the message on the calling thread and folds the traceback
+    into msg; keeping msg, args and exc_info lets the listener's JSON formatter do it instead.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Never block the event loop on a backed-up stdout: drop the record and count it instead
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class DrainingQueueListener(QueueListener):
+    """
+    Queue listener whose stop() waits for room in a full queue instead of raising queue.Full.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
 
 
 def setup_logging():
@@ -29,6 +105,8 @@ def setup_logging():
     Sets up structured JSON logging for the application.
     Logs are formatted in JSON and can be sent to a central log management system like Loki.
     The log level can be dynamically set via an environment variable.
+    Records are queued and written to stdout by a background listener thread,
+    which is returned so it can be stopped (and flushed) on shutdown.
     """
     logger = logging.getLogger()
     logger.handlers.clear()  # Clear any existing handlers to avoid duplicate logs
@@ -40,43 +118,58 @@ def setup_logging():
     logHandler = logging.StreamHandler()
     
     # Use a JSON formatter to structure the logs
-    formatter = jsonlogger.JsonFormatter(
-        '%(asctime)s %(levelname)s %(name)s %(message)s',
-        timestamp=True  # Include timestamp in logs
-    )
-    
+    formatter = OrjsonFormatter()
+
     # Apply the formatter to the log handler
     logHandler.setFormatter(formatter)
     logHandler.setLevel(getattr(logging, log_level, logging.INFO))  # Set handler level based on environment variable
-    logger.addHandler(logHandler)  # Attach the handler to the logger
+
+    # Log calls only enqueue the record; the listener thread does the formatting and the stdout write
+    # The queue is bounded so a stalled stdout costs dropped records rather than unbounded memory
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10_000)))
+    listener = DrainingQueueListener(log_queue, logHandler, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(RecordQueueHandler(log_queue))  # Attach the queue handler to the logger
 
     # Set the log level for the logger
     logger.setLevel(getattr(logging, log_level, logging.INFO))
     logger.propagate = False  # Prevent logs from being propagated to ancestor loggers
 
+    return listener
+
 
 def setup_tracing():
     """
     Sets up OpenTelemetry tracing for the application.
-    Configures Jaeger as the tracing backend, and sets the service name.
-    Traces are batched and sent to the Jaeger agent for processing.
+    Configures an OTLP/gRPC exporter and sets the service name.
+    Traces are batched and sent to the OpenTelemetry Collector, which forwards them to Jaeger.
     """
     # Define the service name for trace attribution
     resource = Resource(attributes={
         SERVICE_NAME: "fastapi-app"
     })
 
-    # Set up Jaeger as the trace exporter
-    jaeger_exporter = JaegerExporter(
-        agent_host_name="jaeger",  # Jaeger agent hostname
-        agent_port=6831,  # Jaeger agent port
+    # Set up OTLP over gRPC as the trace exporter (no UDP packet size ceiling)
+    otlp_exporter = OTLPSpanExporter(
+        endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "otel-collector:4317"),  # Collector gRPC endpoint
+        insecure=True,  # The collector runs inside the compose network without TLS
+        compression=Compression.Gzip,  # Compress span batches on the wire
     )
 
     # Create a TracerProvider with the defined resource
-    provider = TracerProvider(resource=resource)
+    # Sample a fraction of new traces, but always follow the caller's sampling decision
+    sampler = ParentBased(TraceIdRatioBased(float(os.getenv("OTEL_SAMPLE_RATIO", "0.1"))))
+    provider = TracerProvider(resource=resource, sampler=sampler)
 
     # Use a BatchSpanProcessor to handle spans efficiently
-    processor = BatchSpanProcessor(jaeger_exporter)
+    # Smaller batches keep export latency low, a larger queue absorbs bursts
+    processor = BatchSpanProcessor(
+        otlp_exporter,
+        max_queue_size=int(os.getenv("OTEL_BSP_MAX_QUEUE_SIZE", 4096)),
+        schedule_delay_millis=int(os.getenv("OTEL_BSP_SCHEDULE_DELAY", 1000)),
+        max_export_batch_size=int(os.getenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", 256)),
+        export_timeout_millis=int(os.getenv("OTEL_BSP_EXPORT_TIMEOUT", 10000)),
+    )
     provider.add_span_processor(processor)
 
     # Set the global tracer provider for use throughout the application
@@ -86,69 +179,152 @@ def setup_tracing():
 def setup_metrics(app: FastAPI):
     """
     Sets up Prometheus metrics for the FastAPI application.
-    Auto-instruments the FastAPI application and exposes a /metrics endpoint.
+    Exposes the registry at a /metrics endpoint; observations are made by the Observability middleware.
+    With several workers, PROMETHEUS_MULTIPROC_DIR must be set so a scrape sums every worker's metrics
+    instead of reporting whichever process answered. A single worker keeps the default registry,
+    which also carries the process_*, python_gc_* and python_info collectors.
     """
-    # Instrument FastAPI for Prometheus metrics collection
-    Instrumentator().instrument(app).expose(app)
-    
-    # Create a separate ASGI app for exposing metrics
-    metrics_app = make_asgi_app()
-    
-    # Mount the metrics app at the /metrics endpoint
-    app.mount("/metrics", metrics_app)
+    # Serve the metrics at exactly /metrics (a mount would redirect to /metrics/)
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        registry = REGISTRY
+        if multiprocess_metrics():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
 
 
-def setup_logging_middleware(app: FastAPI):
+def multiprocess_metrics() -> bool:
     """
-    Adds middleware to the FastAPI application for logging and metrics collection.
-    Logs details about each HTTP request and updates custom Prometheus metrics.
+    Whether metrics are aggregated across workers through PROMETHEUS_MULTIPROC_DIR.
     """
-    logger = logging.getLogger()
+    return WORKERS > 1 and "PROMETHEUS_MULTIPROC_DIR" in os.environ
 
-    @app.middleware("http")
-    async def log_requests(request: Request, call_next):
-        """
-        Middleware that logs request details and updates Prometheus metrics.
-        It logs the request method, URL, status code, client host, and duration.
-        """
-        start_time = time.time()  # Record the start time of the request
-        IN_PROGRESS.inc()  # Increment the gauge for in-progress requests
 
-        # Pass the request to the next middleware or route handler
-        response = await call_next(request)
+def mark_metrics_process_dead():
+    """
+    Removes this worker's live gauge files so exited workers stop counting towards livesum gauges.
+    """
+    if multiprocess_metrics():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class Observability:
+    """
+    Pure ASGI middleware that traces, measures and logs each HTTP request in a single frame.
+    It replaces FastAPIInstrumentor, the Prometheus Instrumentator and an @app.middleware("http")
+    function, each of which added its own await layer and per-request allocations.
+    """
 
-        # Calculate how long the request took to process
-        duration = time.time() - start_time
+    def __init__(self, app, excluded_urls: ExcludeList):
+        self.app = app
+        self.tracer = trace.get_tracer(__name__)
+        self.logger = logging.getLogger(__name__)
+        # URLs that get no span, e.g. Prometheus scrapes and health checks; they are still measured and logged
+        self.excluded_urls = excluded_urls
+        # Labeled metric children, resolved once per label set instead of through .labels() per request.
+        # Handlers are route templates, so these stay as small as the route table.
+        self.count_children = {}
+        self.latency_children = {}
 
-        # Update Prometheus metrics
-        REQUEST_COUNT.inc()  # Increment the total request count
-        REQUEST_LATENCY.observe(duration)  # Record the request duration in the histogram
-        IN_PROGRESS.dec()  # Decrement the in-progress request gauge
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        # Log the details of the processed request
-        logger.info(f"Request processed", extra={
-            "method": request.method,
-            "url": str(request.url),
-            "status_code": response.status_code,
-            "client_host": request.client.host,
-            "duration": duration
-        })
-        return response
+        path = scope["path"]
+        url = str(URL(scope=scope))  # Same value as str(request.url)
+        method = scope["method"]
+        status_code = 500  # Reported if the app raises before sending a response
+        handler = "none"  # Route template, resolved once the router has matched
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        if self.excluded_urls.url_disabled(url):
+            # Non-recording span, so the attribute calls below are no-ops
+            span_context = nullcontext(trace.INVALID_SPAN)
+        else:
+            # Continue the caller's trace if it sent W3C trace context headers
+            carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+            span_context = self.tracer.start_as_current_span(
+                f"{method} {path}", context=extract(carrier), kind=SpanKind.SERVER
+            )
+
+        start_time = time.perf_counter()  # Record the start time on the monotonic clock
+        IN_PROGRESS.inc()  # Increment the gauge for in-progress requests
+        try:
+            with span_context as span:
+                try:
+                    await self.app(scope, receive, send_wrapper)
+                finally:
+                    # The router stores the matched route in the scope; use its template to bound cardinality
+                    route = scope.get("route")
+                    if route is not None:
+                        handler = route.path
+                    span.update_name(f"{method} {handler}")
+                    span.set_attribute("http.method", method)
+                    span.set_attribute("http.route", handler)
+                    span.set_attribute("http.status_code", status_code)
+                    if status_code >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+        finally:
+            # Calculate how long the request took to process
+            duration = time.perf_counter() - start_time
+            IN_PROGRESS.dec()  # Decrement the in-progress request gauge
+
+            # Update Prometheus metrics
+            count_key = (method, handler, status_code)
+            counter = self.count_children.get(count_key)
+            if counter is None:
+                status_group = f"{status_code // 100}xx"
+                counter = self.count_children[count_key] = REQUEST_COUNT.labels(method, handler, status_group)
+            counter.inc()
+
+            latency_key = (method, handler)
+            histogram = self.latency_children.get(latency_key)
+            if histogram is None:
+                histogram = self.latency_children[latency_key] = REQUEST_LATENCY.labels(method, handler)
+            histogram.observe(duration)
+
+            # Log the details of the processed request, skipping the payload when INFO is disabled
+            if self.logger.isEnabledFor(logging.INFO):
+                client = scope.get("client")
+                self.logger.info("Request processed", extra={
+                    "method": method,
+                    "url": url,
+                    "status_code": status_code,
+                    "client_host": client[0] if client else None,
+                    "duration": duration
+                })
 
 
 def setup_observability(app: FastAPI):
     """
     Orchestrates the setup of all observability components:
     - Logging: Structured JSON logging.
-    - Tracing: OpenTelemetry tracing with Jaeger as the exporter.
-    - Metrics: Prometheus metrics collection and exposure.
-    - Middleware: HTTP request logging and metrics update middleware.
+    - Tracing: OpenTelemetry tracing exported over OTLP to the collector.
+    - Metrics: Prometheus metrics exposure at /metrics.
+    - Middleware: One ASGI middleware that traces, measures and logs every request.
+    Returns the log listener so the caller can stop it on shutdown.
     """
-    setup_logging()  # Set up structured logging
-    setup_tracing()  # Set up tracing with Jaeger
+    log_listener = setup_logging()  # Set up structured logging
+    setup_tracing()  # Set up tracing with the OTLP exporter
     setup_metrics(app)  # Set up Prometheus metrics
-    setup_logging_middleware(app)  # Add middleware for logging and metrics
 
-    # Auto-instrument FastAPI routes and SQLAlchemy for tracing
-    FastAPIInstrumentor.instrument_app(app)
-    SQLAlchemyInstrumentor().instrument(engine=engine)
+    # Prometheus scrapes and health checks would otherwise produce a span every few seconds.
+    # Like OTel's own instrumentations, the value is a comma-separated list of regexes searched in the URL.
+    app.add_middleware(
+        Observability,
+        excluded_urls=parse_excluded_urls(os.getenv("OTEL_PYTHON_EXCLUDED_URLS", "/metrics,/health")),
+    )
+
+    # Auto-instrument SQLAlchemy for tracing only when asked for: a span per statement doubles
+    # span volume for simple by-PK endpoints. The commenter tags SQL with the trace ID for correlation.
+    if os.getenv("ENABLE_SQL_TRACING", "0") == "1":
+        SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine, enable_commenter=True)
+
+    return log_listener
@@ -1,5 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, conlist
 from typing import Optional
+import os
+
+# Upper bound on items per bulk request; the whole payload is validated and inserted in one transaction
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", 10_000))
 
 class ItemBase(BaseModel):
     name: str
@@ -8,6 +12,9 @@ class ItemBase(BaseModel):
 class ItemCreate(ItemBase):
     pass
 
+# Longer lists are rejected with 422 during validation
+ItemBulkCreate = conlist(ItemCreate, max_length=MAX_BULK_ITEMS)
+
 class ItemUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -15,5 +22,4 @@ class ItemUpdate(BaseModel):
 class Item(ItemBase):
     id: int
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
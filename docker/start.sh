@@ -0,0 +1,22 @@
+#!/bin/sh
+# start.sh
+
+set -e
+
+# Default to the CPUs this container may use (affinity mask and cgroup quota), as app/database.py does
+if [ -z "$WORKERS" ]; then
+  WORKERS=$(python -c "from app.database import available_cpus; print(available_cpus())")
+fi
+export WORKERS
+
+# Several workers aggregate their metrics through a shared directory; a single worker keeps
+# prometheus_client's default registry with its process and GC collectors
+if [ "$WORKERS" -gt 1 ]; then
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+else
+  unset PROMETHEUS_MULTIPROC_DIR
+fi
+
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools --workers "$WORKERS"